@@ -1,12 +1,13 @@
 # generate_report.py
-import os, json
+import os, json, hashlib
 import pandas as pd
 from datetime import datetime
-import plotly.graph_objects as go
-import plotly.express as px
+import plotly.io as pio
 import gspread
 from google.oauth2.service_account import Credentials
 from pathlib import Path
+from reporting import (read_columns, clean, yearly,
+                       bucket_distribution, bucket_lists, stacked_bar, pie)
 
 SERVICE_ACCOUNT = os.environ["GOOGLE_SERVICE_ACCOUNT"]
 SHEET_ID        = os.environ["SHEET_ID"]
@@ -24,100 +25,34 @@ creds = Credentials.from_service_account_info(json.loads(SERVICE_ACCOUNT), scope
 gc = gspread.authorize(creds)
 sh = gc.open_by_key(SHEET_ID)
 ws = sh.worksheet(WORKSHEET_NAME)
-rows = ws.get_all_records()
-df_raw = pd.DataFrame(rows)
-
-# Clean
-df_raw = df_raw.rename(columns={c: str(c).strip() for c in df_raw.columns})
-df = df_raw[[DATE_COL, CUSTOMER_COL]].dropna(subset=[DATE_COL, CUSTOMER_COL]).copy()
-df[DATE_COL] = pd.to_datetime(df[DATE_COL], dayfirst=False, errors="coerce")  # mm/dd/yyyy
-df = df[df[DATE_COL].notna()]
-df[CUSTOMER_COL] = df[CUSTOMER_COL].astype(str).str.strip()
+df_raw = read_columns(ws, DATE_COL, CUSTOMER_COL)
+if DATE_COL not in df_raw.columns or CUSTOMER_COL not in df_raw.columns:
+    raise SystemExit(f"[ERR] Columns {DATE_COL!r}, {CUSTOMER_COL!r} not found in sheet header: {list(df_raw.columns)}")
 
 today = pd.Timestamp.today().normalize()
-df = df[df[DATE_COL] <= today]
-if EXCLUDED:
-    df = df[~df[CUSTOMER_COL].isin(EXCLUDED)]
-
 current_year = today.year
-
-# New customers (first-time by month)
-first_purchase = df.groupby(CUSTOMER_COL, as_index=False)[DATE_COL].min()
-first_purchase["year"]  = first_purchase[DATE_COL].dt.year
-first_purchase["month"] = first_purchase[DATE_COL].dt.month
-new_monthly = (
-    first_purchase[first_purchase["year"] == current_year]
-    .groupby("month", as_index=False)
-    .size().rename(columns={"size": "new_customers"})
-)
-
-# Total unique customers per month (dedupe by customer per day)
-df_year = df[df[DATE_COL].dt.year == current_year].copy()
-df_year["date_day"] = df_year[DATE_COL].dt.normalize()
-df_year["month"]    = df_year[DATE_COL].dt.month
-df_year_unique = df_year.drop_duplicates(subset=[CUSTOMER_COL, "date_day"]).copy()
-total_monthly = (
-    df_year_unique.groupby("month")[CUSTOMER_COL]
-    .nunique().reset_index(name="total_unique_customers")
-)
-
-# Merge
-max_month = today.month
-months = pd.DataFrame({"month": list(range(1, max_month + 1))})
-res = (months.merge(total_monthly, on="month", how="left")
-             .merge(new_monthly, on="month", how="left")
-             .fillna(0))
-res["total_unique_customers"] = res["total_unique_customers"].astype(int)
-res["new_customers"]          = res["new_customers"].astype(int)
-res["returning_customers"]    = (res["total_unique_customers"] - res["new_customers"]).clip(lower=0).astype(int)
-res["month_label"]            = res["month"].apply(lambda m: f"{current_year}-{m:02d}")
-
-# Bar (stacked)
-fig_bar = go.Figure()
-fig_bar.add_trace(go.Bar(
-    x=res["month_label"], y=res["returning_customers"],
-    name="مشتریان برگشتی", text=res["returning_customers"],
-    textposition="inside", insidetextanchor="middle"
-))
-fig_bar.add_trace(go.Bar(
-    x=res["month_label"], y=res["new_customers"],
-    name="مشتریان جدید", text=res["new_customers"],
-    textposition="inside", insidetextanchor="middle"
-))
-fig_bar.update_layout(
-    barmode="stack",
-    title=f"مشتریان جدید و کل (انباشته) — {current_year}",
-    font=dict(size=16), title_font=dict(size=22), legend=dict(font=dict(size=14))
-)
-fig_bar.update_traces(texttemplate="%{text}", textfont_size=14, cliponaxis=False)
-fig_bar.update_xaxes(title_text="سال-ماه", tickfont=dict(size=14), title_font=dict(size=18))
-fig_bar.update_yaxes(title_text="تعداد مشتری", tickfont=dict(size=14), title_font=dict(size=18))
-
-# Pie
-tx_per_customer = df_year.groupby(CUSTOMER_COL).size().reset_index(name="tx_count")
-def to_bucket(n): return "5+" if n >= 5 else str(int(n))
-tx_per_customer["bucket"] = tx_per_customer["tx_count"].apply(to_bucket)
-label_map = {"1": "۱ بار", "2": "۲ بار", "3": "۳ بار", "4": "۴ بار", "5+": "۵ بار یا بیشتر"}
-tx_per_customer["bucket_label"] = tx_per_customer["bucket"].map(label_map)
-dist = (tx_per_customer.groupby(["bucket","bucket_label"])
-        .size().reset_index(name="n_customers"))
-order = ["1","2","3","4","5+"]
-dist["order"] = dist["bucket"].apply(lambda x: order.index(x))
-dist = dist.sort_values("order")
-
-fig_pie = px.pie(dist, names="bucket_label", values="n_customers",
-                 title=f"توزیع تعداد خرید مشتریان در سال {current_year}")
-fig_pie.update_traces(textposition="inside", textinfo="label+percent+value")
-fig_pie.update_layout(font=dict(size=16), title_font=dict(size=22), legend=dict(font=dict(size=14)))
-
-bar_html = fig_bar.to_html(full_html=False, include_plotlyjs="cdn")
-pie_html = fig_pie.to_html(full_html=False, include_plotlyjs=False)
+df, first_day = clean(df_raw, DATE_COL, CUSTOMER_COL, EXCLUDED, today)
+res, tx_per_customer = yearly(df, first_day, CUSTOMER_COL, current_year, today)
+fig_bar = stacked_bar(res, current_year)
+fig_pie = pie(bucket_distribution(tx_per_customer), current_year)
+
+# Bare JSON + one newPlot call instead of to_html's wrapper; plotly.js (basic bundle: bar + pie) is loaded once in <head>.
+# Both figures use the same default template (~7 KB of JSON), so it is emitted once and shared.
+template_json = pio.json.to_json_plotly(fig_bar.to_dict()["layout"]["template"])
+
+def plot_div(fig, div_id):
+    fig_dict = fig.to_dict()
+    fig_dict["layout"].pop("template", None)
+    fig_json = pio.to_json(fig_dict, validate=False)  # escapes "<", safe inside <script>
+    return (f'<div id="{div_id}"></div>'
+            f'<script>var f = {fig_json}; f.layout.template = TEMPLATE; '
+            f'Plotly.newPlot("{div_id}", f.data, f.layout, {{responsive: true}});</script>')
+
+bar_html = plot_div(fig_bar, "bar")
+pie_html = plot_div(fig_pie, "pie")
 
 # جدول اسامی: اگر محرمانه است، این بلوک را حذف کن
-lists_by_bucket = (tx_per_customer.sort_values(["bucket", CUSTOMER_COL])
-                   .groupby(["bucket","bucket_label"])[CUSTOMER_COL]
-                   .apply(list).reset_index(name="customers"))
-lists_by_bucket["count"] = lists_by_bucket["customers"].apply(len)
+lists_by_bucket = bucket_lists(tx_per_customer, CUSTOMER_COL)
 
 def list_to_html(names):
     return "<br>".join([str(n) for n in names])
@@ -156,6 +91,8 @@ html = f"""
   <meta http-equiv="Cache-Control" content="no-cache, no-store, must-revalidate" />
   <meta http-equiv="Pragma" content="no-cache" />
   <meta http-equiv="Expires" content="0" />
+  <meta name="content-md5" content="__CONTENT_MD5__" />
+  <script src="https://cdn.plot.ly/plotly-basic-2.35.2.min.js" charset="utf-8"></script>
   <style>
     body {{ font-family: sans-serif; margin: 24px; }}
     h1 {{ font-size: 28px; margin-bottom: 12px; }}
@@ -168,8 +105,9 @@ html = f"""
   </style>
 </head>
 <body>
+  <script>var TEMPLATE = {template_json};</script>
   <h1>گزارش مشتریان — {current_year}</h1>
-  <p class="note">این صفحه روزی یک بار به‌روزرسانی می‌شود. آخرین به‌روزرسانی: {datetime.now().strftime("%Y-%m-%d %H:%M")}</p>
+  <p class="note">این صفحه روزی یک بار به‌روزرسانی می‌شود. آخرین به‌روزرسانی: __UPDATED_AT__</p>
 
   <h2>۱) مشتریان جدید و کل (ستون انباشته)</h2>
   <div class="chart">{bar_html}</div>
@@ -183,6 +121,12 @@ html = f"""
 </html>
 """
 
+# Digest of the full page with the stamp and digest still as placeholders, so any change to
+# data, markup, CSS or scripts changes it; upload_to_drive.py skips uploads when it matches
+content_md5 = hashlib.md5(html.encode("utf-8")).hexdigest()
+html = (html.replace("__CONTENT_MD5__", content_md5)
+            .replace("__UPDATED_AT__", datetime.now().strftime("%Y-%m-%d %H:%M")))
+
 out_dir = Path("build")
 out_dir.mkdir(parents=True, exist_ok=True)
 out_path = out_dir / "new_customers_report.html"
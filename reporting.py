@@ -0,0 +1,149 @@
+# reporting.py
+# Shared read / clean / aggregate / chart code for app.py (Streamlit) and generate_report.py (daily HTML).
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+from gspread.utils import rowcol_to_a1
+
+# Copy-on-write: filtered frames are lazy views, so no defensive .copy() before adding columns
+pd.set_option("mode.copy_on_write", True)
+
+BUCKET_ORDER = ["1", "2", "3", "4", "5+"]
+LABEL_MAP    = {"1": "۱ بار", "2": "۲ بار", "3": "۳ بار", "4": "۴ بار", "5+": "۵ بار یا بیشتر"}
+
+
+def read_columns(ws, date_col, customer_col):
+    # Read only the two needed columns: header row first, then both columns in one batch_get.
+    # If either is missing, return a header-only frame so the caller can report what exists.
+    header = [str(h).strip() for h in ws.row_values(1)]
+    if date_col not in header or customer_col not in header:
+        return pd.DataFrame(columns=header)
+    letters = [rowcol_to_a1(1, header.index(c) + 1)[:-1] for c in (date_col, customer_col)]
+    cols = ws.batch_get([f"{l}2:{l}" for l in letters], major_dimension="COLUMNS",
+                        value_render_option="UNFORMATTED_VALUE",
+                        date_time_render_option="SERIAL_NUMBER")
+    # One contiguous 2D object block; no per-column Series alignment or dtype inference
+    values = [v[0] if v else [] for v in cols]
+    data = np.full((max(map(len, values)), 2), None, dtype=object)
+    for j, v in enumerate(values):
+        data[:len(v), j] = v
+    return pd.DataFrame(data, columns=[date_col, customer_col], copy=False)
+
+
+def clean(df_raw, date_col, customer_col, excluded, today):
+    # -> (df indexed by sorted date with a categorical customer column,
+    #     per-row first-purchase day of that row's customer as a numpy array)
+    df = df_raw[[date_col, customer_col]].dropna(subset=[date_col, customer_col])
+    serial = pd.to_numeric(df[date_col], errors="coerce")
+    m = serial.notna()  # date cells arrive as Sheets serial days, text cells as mm/dd/yyyy
+    dates = pd.Series(pd.NaT, index=df.index, dtype="datetime64[ns]")
+    dates[m] = pd.to_datetime(serial[m], unit="D", origin="1899-12-30", errors="coerce")
+    dates[~m] = pd.to_datetime(df.loc[~m, date_col], format="%m/%d/%Y", errors="coerce")
+    df[date_col] = dates
+    df = df[df[date_col].notna()]
+    df[customer_col] = df[customer_col].astype(str).str.strip().astype("category")
+    # Sorted date index: date/year filters become index slices instead of full-column masks
+    df = df.set_index(date_col).sort_index()
+
+    df = df.loc[:today]
+    if excluded:
+        df[customer_col] = df[customer_col].cat.remove_categories(
+            [c for c in excluded if c in df[customer_col].cat.categories])
+        df = df.dropna(subset=[customer_col])
+
+    # Per-customer first day as one O(N) ufunc reduction over the category codes, gathered back per row
+    codes = df[customer_col].cat.codes.to_numpy()
+    days  = df.index.normalize().to_numpy().view("i8")
+    first = np.full(len(df[customer_col].cat.categories), np.iinfo(np.int64).max)
+    np.minimum.at(first, codes, days)
+    first_day = first[codes].view("datetime64[ns]")
+    return df, first_day
+
+
+def yearly(df, first_day, customer_col, year, today):
+    # -> (res: one row per month up to today, tx_per_customer: purchase count + bucket per customer)
+    in_year = df.index.slice_indexer(str(year), str(year))  # positional slice
+    df_year = df.iloc[in_year]
+    # Customer name kept only on first-purchase-day rows, so its nunique counts new customers
+    df_year = df_year.assign(
+        month=df_year.index.month,
+        new_customer=df_year[customer_col].where(first_day[in_year] == df_year.index.normalize().to_numpy()),
+    )
+    monthly = (
+        df_year.groupby("month", observed=True)
+        .agg(total_unique_customers=(customer_col, "nunique"),
+             new_customers=("new_customer", "nunique"))
+        .reset_index()
+    )
+
+    max_month = (today.month if year == today.year else 12)
+    months = pd.DataFrame({"month": list(range(1, max_month + 1))})
+    res = months.merge(monthly, on="month", how="left").fillna(0)
+    res["total_unique_customers"] = res["total_unique_customers"].astype(int)
+    res["new_customers"]          = res["new_customers"].astype(int)
+    res["returning_customers"]    = (res["total_unique_customers"] - res["new_customers"]).clip(lower=0).astype(int)
+    res["month_label"]            = str(year) + "-" + res["month"].astype(str).str.zfill(2)
+
+    tx_per_customer = df_year.groupby(customer_col, observed=True).size().reset_index(name="tx_count")
+    cnt = tx_per_customer["tx_count"].to_numpy()
+    tx_per_customer["bucket"] = pd.Categorical(np.where(cnt >= 5, "5+", cnt.astype(str)),
+                                               categories=BUCKET_ORDER, ordered=True)
+    tx_per_customer["bucket_label"] = tx_per_customer["bucket"].map(LABEL_MAP)
+    return res, tx_per_customer
+
+
+def bucket_distribution(tx_per_customer):
+    # Categorical value_counts(sort=False) is already in BUCKET_ORDER; empty buckets are left out
+    counts = tx_per_customer["bucket"].value_counts(sort=False)
+    counts = counts[counts > 0]
+    return pd.DataFrame({"bucket": counts.index.astype(str),
+                         "bucket_label": [LABEL_MAP[b] for b in counts.index],
+                         "n_customers": counts.to_numpy()})
+
+
+def bucket_lists(tx_per_customer, customer_col):
+    lists_by_bucket = (tx_per_customer.sort_values(["bucket", customer_col])
+                       .groupby(["bucket","bucket_label"], observed=True)[customer_col]
+                       .apply(list).reset_index(name="customers"))
+    lists_by_bucket["count"] = lists_by_bucket["customers"].apply(len)
+    return lists_by_bucket
+
+
+def stacked_bar(res, year, totals=False):
+    fig = go.Figure()
+    fig.add_trace(go.Bar(
+        x=res["month_label"], y=res["returning_customers"],
+        name="مشتریان برگشتی", text=res["returning_customers"],
+        textposition="inside", insidetextanchor="middle"
+    ))
+    fig.add_trace(go.Bar(
+        x=res["month_label"], y=res["new_customers"],
+        name="مشتریان جدید", text=res["new_customers"],
+        textposition="inside", insidetextanchor="middle"
+    ))
+    fig.update_layout(
+        barmode="stack",
+        title=f"مشتریان جدید و کل (انباشته) — {year}",
+        font=dict(size=16), title_font=dict(size=22), legend=dict(font=dict(size=14))
+    )
+    fig.update_traces(texttemplate="%{text}", textfont_size=14, cliponaxis=False)
+    fig.update_xaxes(title_text="سال-ماه", tickfont=dict(size=14), title_font=dict(size=18))
+    fig.update_yaxes(title_text="تعداد مشتری", tickfont=dict(size=14), title_font=dict(size=18))
+    if totals:
+        # Total above each bar: one text trace instead of one annotation per month
+        fig.add_trace(go.Scatter(
+            x=res["month_label"], y=res["total_unique_customers"],
+            mode="text", text=res["total_unique_customers"].astype(str),
+            textposition="top center", textfont=dict(size=14), cliponaxis=False,
+            showlegend=False, hoverinfo="skip"
+        ))
+    return fig
+
+
+def pie(dist, year):
+    fig = px.pie(dist, names="bucket_label", values="n_customers",
+                 title=f"توزیع تعداد خرید مشتریان در سال {year}")
+    fig.update_traces(textposition="inside", textinfo="label+percent+value")
+    fig.update_layout(font=dict(size=16), title_font=dict(size=22), legend=dict(font=dict(size=14)))
+    return fig
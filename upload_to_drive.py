@@ -1,5 +1,5 @@
 # upload_to_drive.py
-import os, json
+import os, re, sys, json
 from google.oauth2.service_account import Credentials
 from googleapiclient.discovery import build
 from googleapiclient.http import MediaFileUpload
@@ -12,9 +12,21 @@ SCOPES = ["https://www.googleapis.com/auth/drive"]
 creds = Credentials.from_service_account_info(json.loads(SERVICE_ACCOUNT), scopes=SCOPES)
 drive = build("drive", "v3", credentials=creds)
 
+# Skip the upload (and a new Drive revision) when the report content is unchanged.
+# The file's own md5Checksum always differs because of the "last updated" stamp, so compare
+# the content digest generate_report.py embeds against the one stored on the Drive file.
+with open(HTML_PATH, encoding="utf-8") as f:
+    m = re.search(r'<meta name="content-md5" content="([0-9a-f]{32})"', f.read())
+local_md5 = m.group(1) if m else None
+remote = drive.files().get(fileId=DRIVE_FILE_ID, fields="appProperties").execute()
+if local_md5 and local_md5 == remote.get("appProperties", {}).get("content_md5"):
+    print("[OK] Drive file unchanged, skipping upload:", DRIVE_FILE_ID)
+    sys.exit(0)
+
 media = MediaFileUpload(HTML_PATH, mimetype="text/html", resumable=False)
 updated = drive.files().update(
     fileId=DRIVE_FILE_ID,
+    body={"appProperties": {"content_md5": local_md5}} if local_md5 else None,
     media_body=media
 ).execute()
 